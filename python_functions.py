@@ -1,4 +1,6 @@
     
+import ast
+import importlib.util
 import json
 import geojson 
 import geopandas
@@ -15,29 +17,38 @@ from lmd.lib import SegmentationLoader
 import tifffile
 import string
 
+import shapely
 from shapely.geometry import Point, LineString
 
-def dataframe_to_xml_v2(input_file, calibration_points, samples_and_wells):
+#shapely 2.0 exposes vectorized functions that work on whole geometry arrays
+SHAPELY_2 = int(shapely.__version__.split('.')[0]) >= 2
+
+#pyogrio reads GeoJSON much faster than fiona, None lets geopandas pick
+GEOJSON_ENGINE = "pyogrio" if importlib.util.find_spec("pyogrio") is not None else None
+
+def dataframe_to_xml_v2(input_file, calibration_points, samples_and_wells, output_file="./out.xml"):
     
-    df = geopandas.read_file(input_file)
+    #input_file can be a path or an already loaded GeoDataFrame
+    if isinstance(input_file, geopandas.GeoDataFrame):
+        df = input_file
+    else:
+        df = geopandas.read_file(input_file, engine=GEOJSON_ENGINE)
     #calibration_points = ["calib12","calib13","calib20"]
     
     #TODO check that the three calibration points are in the dataframe
 
 
     caliblist = get_calib_points(calibration_points, df)
+    #filter and check first, so coordinates are only extracted for contours that get cut
     clean_df = (df
                 .pipe(start_pipeline)
                 .pipe(remove_calib_points)
-                .pipe(replace_coords)
-                .pipe(replace_coords_simple)
                 .pipe(remove_unclassified_polygons)
-                .pipe(get_contour_type))
+                .pipe(get_contour_type)
+                .pipe(check_classes_have_wells, samples_and_wells)
+                .pipe(replace_coords)
+                .pipe(replace_coords_simple))
 
-    #load the classes 
-    #classes represent all the different wells, each class goes into one well.
-    all_classes = clean_df.Name.unique()
-    
     # #create list of acceptable wells, default is using a space in between columns
     # list_of_acceptable_wells =[]
     # for row in list(string.ascii_uppercase[2:14]):
@@ -59,88 +70,123 @@ def dataframe_to_xml_v2(input_file, calibration_points, samples_and_wells):
     #     for sample_class, well in zip(all_classes, list_of_acceptable_wells):
     #         samples_and_wells[sample_class] = well
         
+    #look up the well of every contour in one pass
+    #a plate has at most 384 wells, so a dict .map is cheaper than a merge here
+    clean_df = clean_df.assign(well = clean_df['Name'].map(samples_and_wells))
+        
     #create the collection of py-lmd-env package
     #uses caliblist passed on the function, order matters
     #orientation vector is for QuPath coordenate system
     the_collection = Collection(calibration_points = caliblist)
     the_collection.orientation_transform = np.array([[1,0 ], [0,-1]])
     print('\nusing simplified shapes')
-    for i in clean_df.index:
-        the_collection.new_shape(clean_df.at[i,'lol_simple'], 
-                                    well = samples_and_wells[clean_df.at[i, "Name"]])
+    for coords, well in clean_df[['lol_simple', 'well']].itertuples(index=False, name=None):
+        the_collection.new_shape(coords, well = well)
     
 
     #save collection as xml
     print('these are your calibration point coordenates')
-    the_collection.save("./out.xml")
+    #output_file can be a path or a writable binary file object such as io.BytesIO
+    the_collection.save(output_file)
 
 
 def start_pipeline(dataf):
     return dataf.copy()
 
 def remove_calib_points(df):
-    #convert entire df to text
-    df_str = df.astype(str)
-    #filter original df by finding the word polygon, poly_df created
-    poly_df = df[df_str['geometry'].str.contains("POLYGON")]
+    #calibration points are Points, keep only Polygons and MultiPolygons
+    if SHAPELY_2:
+        type_ids = shapely.get_type_id(df.geometry.values)
+        is_polygon = np.isin(type_ids, [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON])
+    else:
+        is_polygon = df.geom_type.isin(['Polygon', 'MultiPolygon']).to_numpy()
+    poly_df = df[is_polygon]
     poly_df = poly_df.reset_index(drop=True)
     return(poly_df)              
 
+def get_exterior_coords(geoms, labels):
+    #returns a list with one (n,2) array of exterior coordinates per polygon
+    #a cut path needs a single exterior ring, MultiPolygons and empty shapes are rejected
+    #labels identify the rows in the error message, e.g. the QuPath object ids
+    is_polygon = (geoms.geom_type == 'Polygon') & ~geoms.is_empty
+    if not is_polygon.all():
+        raise ValueError(f"these objects are not single non-empty polygons, cannot extract a cut path: "
+                         f"{labels[~is_polygon].tolist()}")
+    if not SHAPELY_2 or len(geoms) == 0:
+        return [np.asarray(geom.exterior.coords) for geom in geoms]
+    coords, index = shapely.get_coordinates(shapely.get_exterior_ring(geoms.values), return_index=True)
+    #split the flat coordinate array at the start of every polygon
+    split_at = np.cumsum(np.bincount(index, minlength=len(geoms)))[:-1]
+    return np.split(coords, split_at)
+
+def get_object_labels(df):
+    #QuPath object ids identify the contours for the user, fall back to the class name
+    return df['id'] if 'id' in df.columns else df['Name']
+
 def replace_coords(df):
-    df['lol'] = np.nan
-    df['lol'] = df['lol'].astype('object')
-    
-    for i in df.index:
-        #get geometry object for row i
-        geom=df.at[i, 'geometry']
-        #list the coordenate points as tuples
-        tmp = list(geom.exterior.coords)
-        #transform list of tuples to list of lists
-        tmp_lol = [list(i) for i in tmp]
-        #add list of list to lol column
-        df.at[i,'lol'] = tmp_lol
+    df['lol'] = pd.Series(get_exterior_coords(df.geometry, get_object_labels(df)), index=df.index, dtype='object')
     return(df)
 
 def replace_coords_simple(df):
-    df['lol_simple'] = np.nan
-    df['lol_simple'] = df['lol_simple'].astype('object')
-    df['simple'] = df.geometry.simplify(1)
-    
-    for i in df.index:
-        #get geometry object for row i
-        geom=df.at[i, 'simple']
-        #list the coordenate points as tuples
-        tmp = list(geom.exterior.coords)
-        #transform list of tuples to list of lists
-        tmp_lol = [list(i) for i in tmp]
-        #add list of list to lol column
-        df.at[i,'lol_simple'] = tmp_lol
+    #the simplified shapes are only used as cut paths, topology does not need preserving
+    simple = df.geometry.simplify(1, preserve_topology=False)
+    #thin contours can collapse to empty or split into MultiPolygons at narrow necks,
+    #simplify those preserving topology so every polygon keeps a single cut path
+    is_source_polygon = (df.geometry.geom_type == 'Polygon') & ~df.geometry.is_empty
+    is_broken = (simple.geom_type != 'Polygon') | simple.is_empty
+    needs_topology = is_source_polygon & is_broken
+    if needs_topology.any():
+        print(f"{needs_topology.sum()} contours collapsed or split when simplified, "
+              "using topology preserving simplification for them")
+        simple[needs_topology] = df.geometry[needs_topology].simplify(1)
+    df['simple'] = simple
+    df['lol_simple'] = pd.Series(get_exterior_coords(df['simple'], get_object_labels(df)), index=df.index, dtype='object')
     return(df)
 
 def remove_unclassified_polygons(df):
-    if df['classification'].isna().sum() !=0 :
-        print(f"you have {df['classification'].isna().sum()} NaNs in your classification column")
-        print('these are unclassified objects from Qupath, they will be ignored') 
-    df = df[df['classification'].notna()]
+    is_unclassified = df['classification'].isna()
+    n_unclassified = is_unclassified.sum()
+    if n_unclassified != 0:
+        print(f"you have {n_unclassified} NaNs in your classification column\n"
+              "these are unclassified objects from Qupath, they will be ignored")
+    df = df[~is_unclassified]
     return df
 
+def parse_classification(classification):
+    #QuPath writes classifications as JSON, literal_eval only for python style dict strings
+    try:
+        return json.loads(classification)
+    except json.JSONDecodeError:
+        return ast.literal_eval(classification)
+
 def get_contour_type(df):
     #creates a column for polygon type
     #assumes only polygons in dataframe
-    #create empty column
-    df['Name'] = np.nan
-    #fill empty column with whatever is inside dictionary name entry  
-    for i in df.index:
-        tmp = df.classification[i].get('name')
-        df.at[i,'Name'] = tmp
+    #classification is a dict or a string depending on the geojson reader
+    is_str = df['classification'].map(type).eq(str).to_numpy()
+    names = np.empty(len(df), dtype=object)
+    names[is_str] = [parse_classification(c).get('name') for c in df.loc[is_str, 'classification']]
+    names[~is_str] = [c.get('name') for c in df.loc[~is_str, 'classification']]
+    df['Name'] = names
     return(df)
 
+def check_classes_have_wells(df, samples_and_wells):
+    #every class has to be cut into a well, fail before any coordinates are extracted
+    missing = pd.Index(df['Name'].unique()).difference(pd.Index(list(samples_and_wells)), sort=False)
+    if len(missing) != 0:
+        raise KeyError(f"these classes have no well in samples_and_wells: {missing.tolist()}")
+    return df
+
 def get_calib_points(list_of_calibpoint_names, df):
+    #keep only the requested names, first geometry for each name like .values[0] did
+    calib_geoms = (df[df['name'].isin(list_of_calibpoint_names)]
+                   .drop_duplicates('name')
+                   .set_index('name')['geometry'])
     #create shape list
     pointlist = []
     for point_name in list_of_calibpoint_names:
-        if point_name in df['name'].unique():
-            pointlist.append(df.loc[df['name'] == point_name, 'geometry'].values[0])
+        if point_name in calib_geoms.index:
+            pointlist.append(calib_geoms[point_name])
         else:
             print('your given calib name is not present in the file, change it and try again')
             print('these are the calib points you passed: ')
@@ -149,8 +195,5 @@ def get_calib_points(list_of_calibpoint_names, df):
             print(df['name'].unique())
             
     #create coordenate list
-    listarray = []
-    for point in pointlist:
-        listarray.append([point.x, point.y])
-    nparray = np.array(listarray)
+    nparray = np.array([[point.x, point.y] for point in pointlist], dtype=np.float64)
     return(nparray)
\ No newline at end of file
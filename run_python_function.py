@@ -11,6 +11,12 @@ import string
 
 from shapely.geometry import Point, LineString
 
+#create list of acceptable wells, default is using a space in between columns
+#it never changes, so it is built once at import
+ACCEPTABLE_WELLS = tuple(row + str(column)
+                         for row in string.ascii_uppercase[2:14]
+                         for column in range(2,22))
+
 
 def start_pipeline(dataf):
     return dataf.copy()
@@ -110,12 +116,6 @@ def dataframe_to_xml_v2():
     #classes represent all the different wells, each class goes into one well.
     all_classes = clean_df.Name.unique()
     
-    #create list of acceptable wells, default is using a space in between columns
-    list_of_acceptable_wells =[]
-    for row in list(string.ascii_uppercase[2:14]):
-        for column in range(2,22):
-            list_of_acceptable_wells.append(str(row) + str(column))
-            
     #samples_and_wells will be dictionary,key is the sample class, value is the well string
     #loads global variable with that name
     global samples_and_wells 
@@ -125,7 +125,7 @@ def dataframe_to_xml_v2():
     except NameError:
         print("samples_and_wells not detected, assigning wells at random")
         samples_and_wells = {}
-        for sample_class, well in zip(all_classes, list_of_acceptable_wells):
+        for sample_class, well in zip(all_classes, ACCEPTABLE_WELLS):
             samples_and_wells[sample_class] = well
         
     #create the collection of py-lmd-env package
@@ -153,11 +153,17 @@ def dataframe_to_xml_v2():
     #create and export dataframe with sample placement in 384 well plate
     rows_A_P= [i for i in string.ascii_uppercase[:16]]
     columns_1_24 = [str(i) for i in range(1,25)]
-    df_wp384 = pd.DataFrame(0,columns=columns_1_24, index=rows_A_P)
+    #fill a plain numpy array and wrap it in a dataframe once
+    wp384 = np.full((len(rows_A_P), len(columns_1_24)), 0, dtype=object)
+    row_to_index = {row: index for index, row in enumerate(rows_A_P)}
     
     for i in samples_and_wells:
         location = samples_and_wells[i]
-        df_wp384.at[location[0],location[1:]] = i
+        #negative column indexes would silently wrap around, so check the well first
+        if location[:1] not in row_to_index or location[1:] not in columns_1_24:
+            raise ValueError(f"well {location!r} of sample {i!r} is not on a 384 well plate (A1 to P24)")
+        wp384[row_to_index[location[0]], int(location[1:]) - 1] = i
+    df_wp384 = pd.DataFrame(wp384, columns=columns_1_24, index=rows_A_P)
     df_wp384_output_name = os.path.splitext(single_file_path)[0]+'_384_wellplate.csv'
     print('\n csv file of 384 well plate positions, saved as: ')
     print(df_wp384_output_name)
@@ -5,13 +5,13 @@ import datetime
 import tifffile
 import shapely
 import streamlit as st
-from python_functions import dataframe_to_xml_v2
+from python_functions import dataframe_to_xml_v2, GEOJSON_ENGINE
 from lmd.lib import SegmentationLoader
 from lmd.lib import Collection, Shape
 from lmd import tools
 from PIL import Image
-from pathlib import Path
 import ast
+import io
 
 
 
@@ -29,24 +29,31 @@ calibration_point_3 = st.text_input("Enter the name of the third calibration poi
 
 samples_and_wells_input = st.text_area("Enter the desired samples and wells scheme, this is required!")
 
-@st.cache(allow_output_mutation=True)
-def run_script(uploaded_file, calibration_points, samples_and_wells):
+@st.cache_resource
+def load_geojson(file_bytes):
+   # parse the upload once, reruns with the same file reuse the GeoDataFrame
+   return geopandas.read_file(io.BytesIO(file_bytes), engine=GEOJSON_ENGINE)
+
+@st.cache_data(show_spinner=False)
+def run_script(file_bytes, calibration_points, samples_and_wells):
    # Add your script logic here
-   dataframe_to_xml_v2(uploaded_file, calibration_points, samples_and_wells)
+   # write the xml to memory, cached reruns with the same inputs skip the script entirely
+   xml_buffer = io.BytesIO()
+   dataframe_to_xml_v2(load_geojson(file_bytes), calibration_points, samples_and_wells, xml_buffer)
+   return xml_buffer.getvalue()
 
 if st.button("Run the script"):
    #load samples and wells
-   samples_and_wells_processed = samples_and_wells_input.replace("\n", "")
-   samples_and_wells_processed = samples_and_wells_processed.replace(" ", "")
+   # drop all whitespace in a single pass instead of one copy per character type
+   samples_and_wells_processed = "".join(samples_and_wells_input.split())
    samples_and_wells = ast.literal_eval(samples_and_wells_processed)
    #load calibration points
    calibration_points = [calibration_point_1, calibration_point_2, calibration_point_3]
-   st.write("these are your calibration points: ")
-   st.write(calibration_points)
+   st.write("these are your calibration points: ", calibration_points)
    # Run your script or process the inputs
    st.write("Running the script...")
    # Add your script logic here
-   run_script(uploaded_file, calibration_points, samples_and_wells)
+   xml_bytes = run_script(uploaded_file.getvalue(), calibration_points, samples_and_wells)
    #Running is done
    st.write("Please download the file now")
-   st.download_button("Download file", Path("./out.xml").read_text(), "out.xml")
\ No newline at end of file
+   st.download_button("Download file", xml_bytes, "out.xml")
\ No newline at end of file